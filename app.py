@@ -1,4 +1,4 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
@@ -12,11 +12,18 @@ from call_service.main import call_router
 
 # Import database setup
 from auth_service.db import engine as auth_engine, Base as auth_Base
-from chat_service.models import engine as chat_engine, Base as chat_Base
+from chat_service.models import engine as chat_engine, Base as chat_Base, ensure_dm_keys
+
+import metrics
+
+# Count and time every SQL statement per database
+metrics.instrument_engine(auth_engine, "auth")
+metrics.instrument_engine(chat_engine, "chat")
 
 # Create all tables on startup
 auth_Base.metadata.create_all(bind=auth_engine)
 chat_Base.metadata.create_all(bind=chat_engine)
+ensure_dm_keys()
 
 app = FastAPI(title="ChatSphere Unified Backend")
 
@@ -43,6 +50,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route HTTP timings
+app.add_middleware(metrics.HTTPMetricsMiddleware)
+
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     file_extension = file.filename.split(".")[-1]
@@ -64,3 +74,8 @@ app.include_router(call_router, prefix="/call", tags=["Call"])
 @app.get("/health")
 def health_check():
     return {"status": "ok", "message": "ChatSphere Unified Backend is Live"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,41 @@
+"""Compare two benchmarks.load_test result files.
+
+    python -m benchmarks.compare bench_results/old.json bench_results/new.json
+"""
+import argparse
+import json
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if key == "config":
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"{'metric':<45} {baseline.get('revision') or 'baseline':>14} {candidate.get('revision') or 'candidate':>14} {'change':>9}")
+    old, new = flatten(baseline), flatten(candidate)
+    for name in sorted(old.keys() & new.keys()):
+        change = f"{(new[name] - old[name]) / old[name] * 100:+.1f}%" if old[name] else ""
+        print(f"{name:<45} {old[name]:>14.3f} {new[name]:>14.3f} {change:>9}")
+
+
+if __name__ == "__main__":
+    main()
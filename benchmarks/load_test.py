@@ -0,0 +1,354 @@
+"""Load test a single app.py worker through the auth, chat and call paths.
+
+    python -m benchmarks.load_test --clients 2000 --group-size 10 --messages 5
+
+Starts benchmarks.server in a subprocess (SQLite + the in-process broker
+unless told otherwise), drives simulated WebSocket clients against
+/chat/ws/{user_id} and /call/ws/call/{user_id} plus the auth endpoints, and
+writes the results as JSON under bench_results/ for benchmarks.compare.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import requests
+import websockets
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, port):
+    command = [
+        sys.executable, "-m", "benchmarks.server",
+        "--port", str(port),
+        "--database-url", args.database_url,
+        "--redis", args.redis,
+    ]
+    return subprocess.Popen(command, cwd=REPO_ROOT)
+
+
+async def http(method, url, **kwargs):
+    kwargs.setdefault("timeout", 60)
+    response = await asyncio.to_thread(requests.request, method, url, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+
+async def wait_until_ready(base_url, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Benchmark server exited with code {server.returncode}")
+        try:
+            await http("GET", f"{base_url}/health", timeout=1)
+            return
+        except requests.RequestException:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Benchmark server did not become ready")
+
+
+async def gather_limited(limit, coros):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
+
+
+async def bench_auth(base_url, args):
+    users = [
+        {"name": f"bench {i}", "email": f"bench-{uuid.uuid4().hex[:12]}@chatsphere.io", "password": "bench-password"}
+        for i in range(args.auth_users)
+    ]
+    results = {"users": len(users)}
+
+    for endpoint in ("register", "login"):
+        latencies = []
+
+        async def call(user):
+            started = time.perf_counter()
+            await http("POST", f"{base_url}/auth/{endpoint}", json=user)
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await gather_limited(args.concurrency, [call(u) for u in users])
+        elapsed = time.perf_counter() - started
+        results[endpoint] = {
+            "requests_per_sec": len(users) / elapsed if elapsed else None,
+            "latency": percentiles(latencies),
+        }
+    return results
+
+
+async def connect_clients(url_template, user_ids, args):
+    async def connect(user_id):
+        return await websockets.connect(url_template.format(user_id=user_id), max_size=None, open_timeout=60)
+
+    return await gather_limited(args.concurrency, [connect(u) for u in user_ids])
+
+
+async def bench_chat(base_url, ws_url, args):
+    user_ids = [str(uuid.uuid4()) for _ in range(args.clients)]
+    groups = [user_ids[i:i + args.group_size] for i in range(0, len(user_ids), args.group_size)]
+
+    # Memberships must exist before connecting, the socket subscribes on connect
+    async def create(members):
+        chat = await http("POST", f"{base_url}/chat/chats/create", json={
+            "name": f"bench {members[0][:8]}",
+            "is_group": len(members) > 2,
+            "members": members,
+        })
+        return chat["id"]
+
+    chat_ids = await gather_limited(args.concurrency, [create(g) for g in groups])
+    chat_of = {user_id: chat_id for chat_id, members in zip(chat_ids, groups) for user_id in members}
+    size_of = {chat_id: len(members) for chat_id, members in zip(chat_ids, groups)}
+
+    before_connect = await http("GET", f"{base_url}/bench/stats")
+    started = time.perf_counter()
+    sockets = await connect_clients(ws_url + "/chat/ws/{user_id}", user_ids, args)
+    connect_seconds = time.perf_counter() - started
+    await asyncio.sleep(args.settle)
+    connected = await http("GET", f"{base_url}/bench/stats")
+
+    expected = sum(len(g) * len(g) * args.messages for g in groups)
+    latencies = []
+    received = {"message": 0, "typing": 0, "rate_limited": 0}
+    # Deliveries that will never arrive because the message was rate limited
+    skipped = [0]
+    done = asyncio.Event()
+    last_delivery = [None]
+
+    async def receive(ws):
+        try:
+            async for raw in ws:
+                event = json.loads(raw)
+                kind = event.get("type")
+                if kind == "typing":
+                    received["typing"] += 1
+                elif kind == "error" and event.get("code") == "rate_limited":
+                    received["rate_limited"] += 1
+                    if event.get("event_type") == "message":
+                        skipped[0] += size_of[event["chat_id"]]
+                elif kind == "message" and (event.get("content") or "").startswith("bench:"):
+                    now = time.perf_counter()
+                    latencies.append(now - float(event["content"][6:]))
+                    received["message"] += 1
+                    last_delivery[0] = now
+                if received["message"] + skipped[0] >= expected:
+                    done.set()
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send(ws, user_id):
+        chat_id = chat_of[user_id]
+        for _ in range(args.messages):
+            if args.typing:
+                await ws.send(json.dumps({"type": "typing", "chat_id": chat_id, "is_typing": True}))
+            await ws.send(json.dumps({
+                "type": "message",
+                "chat_id": chat_id,
+                "content": f"bench:{time.perf_counter()!r}",
+            }))
+            await asyncio.sleep(args.interval)
+
+    receivers = [asyncio.create_task(receive(ws)) for ws in sockets]
+    send_started = time.perf_counter()
+    await asyncio.gather(*(send(ws, u) for ws, u in zip(sockets, user_ids)))
+    send_seconds = time.perf_counter() - send_started
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        print(f"Timed out with {received['message']}/{expected} deliveries")
+    after = await http("GET", f"{base_url}/bench/stats")
+
+    for ws in sockets:
+        await ws.close()
+    for task in receivers:
+        task.cancel()
+
+    sent = len(user_ids) * args.messages
+    events = sent * (2 if args.typing else 1)
+    elapsed = (last_delivery[0] or time.perf_counter()) - send_started
+    queries = after["db_queries"] - connected["db_queries"]
+    return {
+        "clients": len(user_ids),
+        "chats": len(chat_ids),
+        "group_size": args.group_size,
+        "connect_seconds": connect_seconds,
+        "rss_per_connection_bytes": (connected["rss_bytes"] - before_connect["rss_bytes"]) / len(user_ids),
+        "messages_sent": sent,
+        "events_sent": events,
+        "send_seconds": send_seconds,
+        "messages_per_sec": sent / elapsed if elapsed else None,
+        "deliveries_expected": expected,
+        "deliveries_received": received["message"],
+        "typing_received": received["typing"],
+        "rate_limited_received": received["rate_limited"],
+        "deliveries_per_sec": received["message"] / elapsed if elapsed else None,
+        "fanout_latency": percentiles(latencies),
+        "db_queries_per_event": queries / events if events else None,
+        "db_query_ms_per_event": (after["db_query_seconds"] - connected["db_query_seconds"]) * 1000 / events if events else None,
+        "db_queries_on_connect": (connected["db_queries"] - before_connect["db_queries"]) / len(user_ids),
+    }
+
+
+async def bench_call(base_url, ws_url, args):
+    callers = [str(uuid.uuid4()) for _ in range(args.call_pairs)]
+    callees = [str(uuid.uuid4()) for _ in range(args.call_pairs)]
+    sockets = await connect_clients(ws_url + "/call/ws/call/{user_id}", callers + callees, args)
+    caller_sockets, callee_sockets = sockets[:len(callers)], sockets[len(callers):]
+
+    expected = args.call_pairs * args.messages
+    latencies = []
+    done = asyncio.Event()
+    last_delivery = [None]
+
+    async def receive(ws):
+        try:
+            async for raw in ws:
+                event = json.loads(raw)
+                now = time.perf_counter()
+                latencies.append(now - event["payload"]["sent_at"])
+                last_delivery[0] = now
+                if len(latencies) >= expected:
+                    done.set()
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send(ws, target):
+        for _ in range(args.messages):
+            await ws.send(json.dumps({
+                "type": "ice-candidate",
+                "target_user_id": target,
+                "payload": {"sent_at": time.perf_counter()},
+            }))
+            await asyncio.sleep(args.interval)
+
+    receivers = [asyncio.create_task(receive(ws)) for ws in callee_sockets]
+    started = time.perf_counter()
+    await asyncio.gather(*(send(ws, t) for ws, t in zip(caller_sockets, callees)))
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        print(f"Timed out with {len(latencies)}/{expected} call relays")
+
+    for ws in sockets:
+        await ws.close()
+    for task in receivers:
+        task.cancel()
+
+    elapsed = (last_delivery[0] or time.perf_counter()) - started
+    return {
+        "pairs": args.call_pairs,
+        "relays_expected": expected,
+        "relays_received": len(latencies),
+        "relays_per_sec": len(latencies) / elapsed if elapsed else None,
+        "relay_latency": percentiles(latencies),
+    }
+
+
+async def run(args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    ws_url = f"ws://127.0.0.1:{port}"
+    server = start_server(args, port)
+    try:
+        await wait_until_ready(base_url, server)
+        results = {
+            "revision": git_revision(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "config": vars(args),
+        }
+        if args.auth_users:
+            results["auth"] = await bench_auth(base_url, args)
+        if args.clients:
+            results["chat"] = await bench_chat(base_url, ws_url, args)
+        if args.call_pairs:
+            results["call"] = await bench_call(base_url, ws_url, args)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=1000, help="chat WebSocket clients")
+    parser.add_argument("--group-size", type=int, default=10, help="members per chat")
+    parser.add_argument("--messages", type=int, default=5, help="messages sent per client")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between a client's messages")
+    parser.add_argument("--typing", action="store_true", help="send a typing event before every message")
+    parser.add_argument("--call-pairs", type=int, default=200, help="caller/callee pairs on the call socket")
+    parser.add_argument("--auth-users", type=int, default=50, help="users to register and log in")
+    parser.add_argument("--concurrency", type=int, default=100, help="parallel HTTP requests / connects")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to wait for subscriptions after connecting")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for outstanding deliveries")
+    parser.add_argument("--database-url", default=None, help="defaults to a fresh SQLite file")
+    parser.add_argument("--redis", default="memory", help="'memory' or a Redis URL")
+    parser.add_argument("--output", default=None, help="result file, defaults to bench_results/<time>-<rev>.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.database_url is None:
+            args.database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        results = asyncio.run(run(args))
+
+    output = args.output
+    if output is None:
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(REPO_ROOT, "bench_results", f"{stamp}-{results['revision'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
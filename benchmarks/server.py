@@ -0,0 +1,82 @@
+"""Run the unified app.py backend against local stand-ins for benchmarking.
+
+    python -m benchmarks.server --port 8765 --database-url sqlite:///./bench.db
+
+Exposes GET /bench/stats with the app's DB query metrics and process RSS so the
+load driver (benchmarks/load_test.py) can work out per-event and
+per-connection costs.
+"""
+import argparse
+import os
+import resource
+
+
+def metric_total(name):
+    # Sum a metric from app.py's /metrics registry over its database labels
+    from prometheus_client import REGISTRY
+
+    return sum(
+        sample.value
+        for family in REGISTRY.collect()
+        for sample in family.samples
+        if sample.name == name
+    )
+
+
+def rss_bytes():
+    # Current RSS from /proc on Linux, peak RSS everywhere else
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def build_app():
+    # Imported late so DATABASE_URL / BROKER / REDIS_URL from the command line apply
+    from app import app
+    from chat_service.main import manager as chat_manager
+    from call_service.main import manager as call_manager
+
+    @app.get("/bench/stats", include_in_schema=False)
+    def bench_stats():
+        return {
+            "db_queries": metric_total("chatsphere_db_queries_total"),
+            "db_query_seconds": metric_total("chatsphere_db_query_seconds_sum"),
+            "rss_bytes": rss_bytes(),
+            "chat_connections": len(chat_manager.active_connections),
+            "call_connections": len(call_manager.active_connections),
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./bench.db"))
+    parser.add_argument(
+        "--redis",
+        default="memory",
+        help="'memory' for the in-process broker, otherwise a Redis URL (e.g. redis://localhost:6379)",
+    )
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url
+    if args.redis == "memory":
+        os.environ["BROKER"] = "memory"
+    else:
+        os.environ["BROKER"] = "redis"
+        os.environ["REDIS_URL"] = args.redis
+
+    import uvicorn
+
+    uvicorn.run(build_app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ from typing import Dict
 import json
 import os
 
+import metrics
+
 call_router = APIRouter()
 
 class CallConnectionManager:
@@ -22,6 +24,7 @@ class CallConnectionManager:
             await self.active_connections[user_id].send_json(data)
 
 manager = CallConnectionManager()
+metrics.track_sockets("call", manager.active_connections)
 
 @call_router.websocket("/ws/call/{user_id}")
 async def call_websocket(websocket: WebSocket, user_id: str):
@@ -31,6 +34,7 @@ async def call_websocket(websocket: WebSocket, user_id: str):
             data = await websocket.receive_json()
             target_user_id = data.get("target_user_id")
             event_type = data.get("type") # offer, answer, ice-candidate, call-request
+            metrics.record_event("call", event_type)
             
             # Relay signaling data to target user
             if target_user_id:
@@ -44,4 +48,5 @@ async def call_websocket(websocket: WebSocket, user_id: str):
         manager.disconnect(user_id)
     except Exception as e:
         print(f"Call Signaling error: {e}")
+        metrics.ERRORS.labels(where="call_websocket").inc()
         manager.disconnect(user_id)
@@ -0,0 +1,142 @@
+import redis.asyncio as redis
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+
+import metrics
+
+# Messages buffered per in-process subscriber before it is disconnected,
+# the equivalent of Redis' pubsub output buffer limit for a slow reader
+MEMORY_QUEUE_SIZE = int(os.getenv("BROKER_QUEUE_SIZE", "1000"))
+
+# Brokers share one interface: connect(), publish(channel, message) and
+# pubsub() returning a subscription with subscribe/unsubscribe/listen.
+# listen() yields {"channel", "data", "text", "published_at"} where data is
+# the published dict and text its JSON, ready to forward with send_text.
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    async def subscribe(self, *channels):
+        await self.pubsub.subscribe(*channels)
+
+    async def unsubscribe(self, *channels):
+        await self.pubsub.unsubscribe(*channels)
+
+    async def listen(self):
+        async for message in self.pubsub.listen():
+            if message["type"] != "message":
+                continue
+            data = json.loads(message["data"])
+            published_at = data.pop("_published_at", None)
+            yield {
+                "channel": message["channel"],
+                "data": data,
+                "text": json.dumps(data),
+                "published_at": published_at,
+            }
+
+
+class RedisBroker:
+    def __init__(self, url):
+        self.url = url
+        self.redis = None
+
+    async def connect(self):
+        # Log the connection attempt (safely masking password if present)
+        safe_url = self.url.split("@")[-1] if "@" in self.url else self.url
+        print(f"Connecting to Redis at: {safe_url}")
+
+        self.redis = await redis.from_url(self.url, decode_responses=True)
+        print("Successfully connected to Redis")
+
+    async def publish(self, channel, message):
+        # Stamp the publish time so subscribers can measure fan-out latency
+        await self.redis.publish(channel, json.dumps({**message, "_published_at": time.time()}))
+
+    def pubsub(self):
+        return RedisSubscription(self.redis.pubsub())
+
+
+class MemorySubscription:
+    def __init__(self, broker):
+        self.broker = broker
+        self.channels = set()
+        self.queue = asyncio.Queue(maxsize=MEMORY_QUEUE_SIZE)
+        self.closed = False
+
+    async def subscribe(self, *channels):
+        if self.closed:
+            return
+        for channel in channels:
+            self.broker.subscribers[channel].add(self)
+            self.channels.add(channel)
+
+    async def unsubscribe(self, *channels):
+        self.remove(*channels)
+
+    def remove(self, *channels):
+        for channel in channels or list(self.channels):
+            subscribers = self.broker.subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(self)
+                if not subscribers:
+                    del self.broker.subscribers[channel]
+            self.channels.discard(channel)
+
+    def close(self):
+        # Like Redis dropping a client over its output buffer limit: stop
+        # delivering, free the backlog and make listen() raise
+        self.closed = True
+        self.remove()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def listen(self):
+        while True:
+            message = await self.queue.get()
+            if message is None:
+                raise ConnectionError("Subscriber fell too far behind and was disconnected")
+            yield message
+
+
+class MemoryBroker:
+    """In-process fan-out for single-node deployments, tests and benchmarks.
+
+    Every subscriber receives the same message object, so nothing is copied
+    or re-encoded per subscriber; consumers must treat it as read-only.
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+
+    async def connect(self):
+        print("Using in-process message broker")
+
+    async def publish(self, channel, message):
+        subscribers = self.subscribers.get(channel)
+        if not subscribers:
+            return
+        envelope = {
+            "channel": channel,
+            "data": message,
+            "text": json.dumps(message),
+            "published_at": time.time(),
+        }
+        # Copied since closing a subscriber removes it from the set
+        for subscription in list(subscribers):
+            try:
+                subscription.queue.put_nowait(envelope)
+            except asyncio.QueueFull:
+                # The socket isn't being drained; disconnect it rather than
+                # silently dropping messages, the client reconnects and resyncs
+                metrics.ERRORS.labels(where="broker_queue_full").inc()
+                subscription.close()
+
+    def pubsub(self):
+        return MemorySubscription(self)
@@ -3,12 +3,17 @@ from typing import List, Dict
 import json
 import uuid
 import asyncio
+import time
 from datetime import datetime
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 
+import metrics
+
 # Relative imports
-from .models import Chat, Message, ChatMember, get_db
+from .models import Chat, Message, ChatMember, get_db, make_dm_key, dialect_insert
 from .redis_manager import redis_manager
+from .rate_limiter import rate_limiter
 
 chat_router = APIRouter()
 
@@ -29,6 +34,7 @@ class ConnectionManager:
             await self.active_connections[user_id].send_text(message)
 
 manager = ConnectionManager()
+metrics.track_sockets("chat", manager.active_connections)
 
 @chat_router.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
@@ -40,9 +46,14 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
         u_id = user_id
 
     # Subscribe to all chats the user is a member of
+    # Release the session straight away so idle sockets don't hold pool connections
     db: Session = next(get_db())
-    member_chats = db.query(ChatMember.chat_id).filter(ChatMember.user_id == u_id).all()
+    try:
+        member_chats = db.query(ChatMember.chat_id).filter(ChatMember.user_id == u_id).all()
+    finally:
+        db.close()
     chat_ids = [str(c[0]) for c in member_chats]
+    member_chat_ids = set(chat_ids)
     
     pubsub = redis_manager.get_pubsub()
     for cid in chat_ids:
@@ -54,14 +65,41 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
     async def broadcast_handler():
         try:
             async for message in pubsub.listen():
-                if message["type"] == "message":
-                    data = json.loads(message["data"])
-                    await websocket.send_text(json.dumps(data))
+                # Forward the broker's encoded text as-is, no per-socket re-encoding
+                await websocket.send_text(message["text"])
+                if message["published_at"] is not None:
+                    metrics.FANOUT_SECONDS.observe(time.time() - message["published_at"])
         except Exception as e:
             print(f"Broadcast error for {user_id}: {e}")
+            metrics.ERRORS.labels(where="chat_broadcast").inc()
+        # The subscription is gone (e.g. dropped for falling behind), close the
+        # socket so the client reconnects instead of silently missing messages
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
 
     broadcast_task = asyncio.create_task(broadcast_handler())
 
+    async def send_error(code, event_type, chat_id, **fields):
+        await websocket.send_text(json.dumps({
+            "type": "error",
+            "code": code,
+            "event_type": event_type,
+            "chat_id": chat_id,
+            **fields
+        }))
+
+    def is_member(chat_id):
+        db_member: Session = next(get_db())
+        try:
+            return db_member.query(ChatMember).filter(
+                ChatMember.chat_id == uuid.UUID(chat_id),
+                ChatMember.user_id == u_id
+            ).first() is not None
+        finally:
+            db_member.close()
+
     try:
         while True:
             data = await websocket.receive_text()
@@ -69,133 +107,168 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             event_type = message_data.get("type", "message")
             chat_id = message_data.get("chat_id")
             
-            # Use a fresh DB session for each message to avoid stale connections
-            db_msg: Session = next(get_db())
+            metrics.record_event("chat", event_type)
+
             try:
-                if event_type == "typing":
-                    await redis_manager.publish(f"chat_{chat_id}", {
-                        "type": "typing",
-                        "user_id": user_id,
-                        "chat_id": chat_id,
-                        "is_typing": message_data.get("is_typing")
-                    })
-                elif event_type == "read_receipt":
-                    msg_id = message_data.get("message_id")
-                    db_m = db_msg.query(Message).filter(Message.id == msg_id).first()
-                    if db_m:
-                        db_m.is_read = True
-                        db_msg.commit()
+                chat_id = str(uuid.UUID(str(chat_id)))
+            except ValueError:
+                await send_error("not_a_member", event_type, chat_id)
+                continue
+
+            # Only chats this socket belongs to reach the limiter and the DB.
+            # Chats created after connecting are looked up once, charged to the
+            # user bucket first so unknown ids can't be used to flood the DB
+            charge_user = True
+            if chat_id not in member_chat_ids:
+                throttled = await rate_limiter.check(user_id, None, event_type)
+                if throttled is not None:
+                    scope, retry_after = throttled
+                    await send_error("rate_limited", event_type, chat_id, scope=scope, retry_after=round(retry_after, 3))
+                    continue
+                if not is_member(chat_id):
+                    await send_error("not_a_member", event_type, chat_id)
+                    continue
+                member_chat_ids.add(chat_id)
+                await pubsub.subscribe(f"chat_{chat_id}")
+                # The user token is already spent, only charge the chat
+                charge_user = False
+
+            # Reject floods before they turn into DB writes and fan-out
+            throttled = await rate_limiter.check(user_id, chat_id, event_type, charge_user=charge_user)
+            if throttled is not None:
+                scope, retry_after = throttled
+                await send_error("rate_limited", event_type, chat_id, scope=scope, retry_after=round(retry_after, 3))
+                continue
+
+            with metrics.span("chat.ws_event", event_type=event_type, chat_id=chat_id):
+                # Use a fresh DB session for each message to avoid stale connections
+                db_msg: Session = next(get_db())
+                try:
+                    if event_type == "typing":
+                        await redis_manager.publish(f"chat_{chat_id}", {
+                            "type": "typing",
+                            "user_id": user_id,
+                            "chat_id": chat_id,
+                            "is_typing": message_data.get("is_typing")
+                        })
+                    elif event_type == "read_receipt":
+                        msg_id = message_data.get("message_id")
+                        db_m = db_msg.query(Message).filter(Message.id == msg_id).first()
+                        if db_m:
+                            db_m.is_read = True
+                            db_msg.commit()
 
-                    await redis_manager.publish(f"chat_{chat_id}", {
-                        "type": "read_receipt",
-                        "message_id": msg_id,
-                        "chat_id": chat_id,
-                        "user_id": user_id
-                    })
-                elif event_type == "delete_message":
-                    msg_id = message_data.get("message_id")
-                    for_everyone = message_data.get("for_everyone", False)
-                    db_m = db_msg.query(Message).filter(Message.id == msg_id).first()
+                        await redis_manager.publish(f"chat_{chat_id}", {
+                            "type": "read_receipt",
+                            "message_id": msg_id,
+                            "chat_id": chat_id,
+                            "user_id": user_id
+                        })
+                    elif event_type == "delete_message":
+                        msg_id = message_data.get("message_id")
+                        for_everyone = message_data.get("for_everyone", False)
+                        db_m = db_msg.query(Message).filter(Message.id == msg_id).first()
                     
-                    if db_m:
-                        if for_everyone and str(db_m.sender_id) == user_id:
-                            db_m.content = "This message was deleted"
-                            db_m.message_type = "deleted"
+                        if db_m:
+                            if for_everyone and str(db_m.sender_id) == user_id:
+                                db_m.content = "This message was deleted"
+                                db_m.message_type = "deleted"
+                                db_msg.commit()
+                                await redis_manager.publish(f"chat_{chat_id}", {
+                                    "type": "delete_message",
+                                    "message_id": msg_id,
+                                    "chat_id": chat_id,
+                                    "for_everyone": True
+                                })
+                            else:
+                                # Delete for me
+                                current_deleted = list(db_m.deleted_for_users or [])
+                                if user_id not in current_deleted:
+                                    current_deleted.append(user_id)
+                                    db_m.deleted_for_users = current_deleted
+                                    db_msg.commit()
+                            
+                                await websocket.send_text(json.dumps({
+                                    "type": "delete_message",
+                                    "message_id": msg_id,
+                                    "chat_id": chat_id,
+                                    "for_everyone": False
+                                }))
+
+                    elif event_type == "reaction":
+                        msg_id = message_data.get("message_id")
+                        emoji = message_data.get("emoji")
+                        db_m = db_msg.query(Message).filter(Message.id == msg_id).first()
+                        if db_m:
+                            current_reactions = dict(db_m.reactions or {})
+                            if emoji in current_reactions:
+                                if user_id in current_reactions[emoji]:
+                                    current_reactions[emoji].remove(user_id)
+                                else:
+                                    current_reactions[emoji].append(user_id)
+                            else:
+                                current_reactions[emoji] = [user_id]
+                        
+                            db_m.reactions = current_reactions
+                            db_msg.add(db_m)
                             db_msg.commit()
+
                             await redis_manager.publish(f"chat_{chat_id}", {
-                                "type": "delete_message",
+                                "type": "reaction",
                                 "message_id": msg_id,
                                 "chat_id": chat_id,
-                                "for_everyone": True
+                                "user_id": user_id,
+                                "emoji": emoji,
+                                "reactions": db_m.reactions
                             })
-                        else:
-                            # Delete for me
-                            current_deleted = list(db_m.deleted_for_users or [])
-                            if user_id not in current_deleted:
-                                current_deleted.append(user_id)
-                                db_m.deleted_for_users = current_deleted
-                                db_msg.commit()
-                            
-                            await websocket.send_text(json.dumps({
-                                "type": "delete_message",
-                                "message_id": msg_id,
-                                "chat_id": chat_id,
-                                "for_everyone": False
-                            }))
-
-                elif event_type == "reaction":
-                    msg_id = message_data.get("message_id")
-                    emoji = message_data.get("emoji")
-                    db_m = db_msg.query(Message).filter(Message.id == msg_id).first()
-                    if db_m:
-                        current_reactions = dict(db_m.reactions or {})
-                        if emoji in current_reactions:
-                            if user_id in current_reactions[emoji]:
-                                current_reactions[emoji].remove(user_id)
-                            else:
-                                current_reactions[emoji].append(user_id)
-                        else:
-                            current_reactions[emoji] = [user_id]
+                    else:
+                        try:
+                            c_id = uuid.UUID(chat_id)
+                            u_id = uuid.UUID(user_id)
+                        except ValueError:
+                            c_id = chat_id
+                            u_id = user_id
                         
-                        db_m.reactions = current_reactions
-                        db_msg.add(db_m)
+                        new_msg = Message(
+                            sender_id=u_id,
+                            chat_id=c_id,
+                            content=message_data.get("content"),
+                            message_type=message_data.get("message_type", "text"),
+                            file_url=message_data.get("file_url"),
+                            reply_to_id=message_data.get("reply_to_id"),
+                            reply_to_content=message_data.get("reply_to_content")
+                        )
+                        db_msg.add(new_msg)
                         db_msg.commit()
+                        db_msg.refresh(new_msg)
 
                         await redis_manager.publish(f"chat_{chat_id}", {
-                            "type": "reaction",
-                            "message_id": msg_id,
+                            "type": "message",
+                            "id": str(new_msg.id),
+                            "sender_id": user_id,
                             "chat_id": chat_id,
-                            "user_id": user_id,
-                            "emoji": emoji,
-                            "reactions": db_m.reactions
+                            "content": new_msg.content,
+                            "message_type": new_msg.message_type,
+                            "file_url": new_msg.file_url,
+                            "timestamp": new_msg.timestamp.isoformat(),
+                            "reply_to_id": str(new_msg.reply_to_id) if new_msg.reply_to_id else None,
+                            "reply_to_content": new_msg.reply_to_content
                         })
-                else:
-                    try:
-                        c_id = uuid.UUID(chat_id)
-                        u_id = uuid.UUID(user_id)
-                    except ValueError:
-                        c_id = chat_id
-                        u_id = user_id
-                        
-                    new_msg = Message(
-                        sender_id=u_id,
-                        chat_id=c_id,
-                        content=message_data.get("content"),
-                        message_type=message_data.get("message_type", "text"),
-                        file_url=message_data.get("file_url"),
-                        reply_to_id=message_data.get("reply_to_id"),
-                        reply_to_content=message_data.get("reply_to_content")
-                    )
-                    db_msg.add(new_msg)
-                    db_msg.commit()
-                    db_msg.refresh(new_msg)
-
-                    await redis_manager.publish(f"chat_{chat_id}", {
-                        "type": "message",
-                        "id": str(new_msg.id),
-                        "sender_id": user_id,
-                        "chat_id": chat_id,
-                        "content": new_msg.content,
-                        "message_type": new_msg.message_type,
-                        "file_url": new_msg.file_url,
-                        "timestamp": new_msg.timestamp.isoformat(),
-                        "reply_to_id": str(new_msg.reply_to_id) if new_msg.reply_to_id else None,
-                        "reply_to_content": new_msg.reply_to_content
-                    })
-            finally:
-                db_msg.close()
+                finally:
+                    db_msg.close()
             
     except WebSocketDisconnect:
         manager.disconnect(user_id)
+        rate_limiter.forget(user_id)
         broadcast_task.cancel()
         await pubsub.unsubscribe()
     except Exception as e:
         print(f"WebSocket error: {e}")
+        metrics.ERRORS.labels(where="chat_websocket").inc()
         manager.disconnect(user_id)
+        rate_limiter.forget(user_id)
         broadcast_task.cancel()
         await pubsub.unsubscribe()
-    finally:
-        db.close()
 
 @chat_router.get("/history/{chat_id}")
 def get_chat_history(chat_id: str, user_id: str, db: Session = Depends(get_db)):
@@ -264,45 +337,42 @@ def get_user_conversations(user_id: str, db: Session = Depends(get_db)):
 @chat_router.post("/chats/create")
 def create_chat(data: dict, db: Session = Depends(get_db)):
     is_group = data.get("is_group", False)
-    members = data.get("members", [])
-    
-    # For 1-on-1 chats, check if one already exists
-    if not is_group and len(members) == 2:
-        try:
-            u1, u2 = uuid.UUID(members[0]), uuid.UUID(members[1])
-        except ValueError:
-            u1, u2 = members[0], members[1]
-        
-        # Find chat IDs that u1 is a member of
-        u1_chats = db.query(ChatMember.chat_id).filter(ChatMember.user_id == u1).all()
-        u1_chat_ids = [c[0] for c in u1_chats]
-        
-        # Find which of those u2 is ALSO a member of, and is NOT a group chat
-        existing_chat = db.query(Chat).join(ChatMember).filter(
-            Chat.id == ChatMember.chat_id,
-            Chat.id.in_(u1_chat_ids),
-            ChatMember.user_id == u2,
-            Chat.is_group == False
-        ).first()
-        
-        if existing_chat:
-            return {"id": str(existing_chat.id), "status": "existing"}
-
-    new_chat = Chat(
-        name=data.get("name"),
-        is_group=is_group
-    )
-    db.add(new_chat)
-    db.commit()
-    db.refresh(new_chat)
-    
-    for user_id in members:
+    members = []
+    for user_id in dict.fromkeys(data.get("members", [])):
         try:
-            u_id = uuid.UUID(user_id)
+            members.append(uuid.UUID(user_id))
         except ValueError:
-            u_id = user_id
-        member = ChatMember(chat_id=new_chat.id, user_id=u_id)
-        db.add(member)
+            members.append(user_id)
+
+    # For 1-on-1 chats, claim the ordered user pair; the unique dm_key makes
+    # lookup-or-create a single atomic statement even under concurrent requests
+    if not is_group and len(members) == 2:
+        dm_key = make_dm_key(*members)
+        chat_id = db.execute(
+            dialect_insert(Chat)
+            .values(name=data.get("name"), is_group=False, dm_key=dm_key)
+            .on_conflict_do_nothing(index_elements=[Chat.dm_key])
+            .returning(Chat.id)
+        ).scalar()
+
+        if chat_id is None:
+            existing_id = db.query(Chat.id).filter(Chat.dm_key == dm_key).scalar()
+            db.rollback()
+            return {"id": str(existing_id), "status": "existing"}
+    else:
+        new_chat = Chat(
+            name=data.get("name"),
+            is_group=is_group
+        )
+        db.add(new_chat)
+        db.flush()
+        chat_id = new_chat.id
+
+    # All members in one multi-row INSERT, committed together with the chat
+    if members:
+        db.execute(insert(ChatMember).values([
+            {"chat_id": chat_id, "user_id": u_id} for u_id in members
+        ]))
     db.commit()
-    
-    return {"id": str(new_chat.id), "status": "created"}
+
+    return {"id": str(chat_id), "status": "created"}
@@ -1,8 +1,9 @@
-from sqlalchemy import Column, String, Boolean, DateTime, UUID, ForeignKey, JSON
+from sqlalchemy import Column, String, Boolean, DateTime, UUID, ForeignKey, JSON, inspect, select, update, bindparam, text
 import uuid
 from datetime import datetime
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.orm import sessionmaker
 import os
 
@@ -18,6 +19,8 @@ class Chat(Base):
     is_group = Column(Boolean, default=False)
     name = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Ordered "user_a:user_b" pair for 1:1 chats, NULL for groups
+    dm_key = Column(String, nullable=True, unique=True, index=True)
 
 class ChatMember(Base):
     __tablename__ = "chat_members"
@@ -40,6 +43,74 @@ class Message(Base):
     reply_to_content = Column(String, nullable=True)
     deleted_for_users = Column(JSON, default=[]) # list of user_ids who deleted for themselves
 
+def make_dm_key(user_a, user_b):
+    return ":".join(sorted([str(user_a), str(user_b)]))
+
+def dialect_insert(model):
+    # INSERT that supports on_conflict_do_nothing on the configured database
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+# Arbitrary constant for pg_advisory_xact_lock while migrating dm_key
+DM_KEY_MIGRATION_LOCK = 7305412
+
+def has_dm_key(bind):
+    return "dm_key" in [c["name"] for c in inspect(bind).get_columns("chats")]
+
+def ensure_dm_keys():
+    """Add chats.dm_key to databases created before it existed and backfill it.
+
+    Runs in every worker at startup, so concurrent starts must not race."""
+    if has_dm_key(engine):
+        return
+
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == "postgresql":
+                # Only one worker migrates, the rest wait here and see the column
+                conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": DM_KEY_MIGRATION_LOCK})
+                if has_dm_key(conn):
+                    return
+            migrate_dm_keys(conn)
+    except (OperationalError, ProgrammingError):
+        # Another worker added the column between the check and the ALTER
+        if has_dm_key(engine):
+            return
+        raise
+
+def migrate_dm_keys(conn):
+    conn.execute(text("ALTER TABLE chats ADD COLUMN dm_key VARCHAR"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_chats_dm_key ON chats (dm_key)"))
+
+    rows = conn.execute(
+        select(Chat.id, ChatMember.user_id)
+        .join(ChatMember, ChatMember.chat_id == Chat.id)
+        .where(Chat.is_group == False)
+        .order_by(Chat.created_at)
+    ).all()
+    members = {}
+    for chat_id, user_id in rows:
+        members.setdefault(chat_id, []).append(user_id)
+
+    # Oldest chat wins if a pair already has duplicate DMs
+    seen = set()
+    updates = []
+    for chat_id, users in members.items():
+        if len(users) != 2:
+            continue
+        key = make_dm_key(*users)
+        if key not in seen:
+            seen.add(key)
+            updates.append({"b_id": chat_id, "b_key": key})
+    if updates:
+        conn.execute(
+            update(Chat).where(Chat.id == bindparam("b_id")).values(dm_key=bindparam("b_key")),
+            updates
+        )
+
 def get_db():
     db = SessionLocal()
     try:
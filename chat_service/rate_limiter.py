@@ -0,0 +1,222 @@
+import json
+import os
+import time
+
+import metrics
+from .redis_manager import redis_manager
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() not in ("0", "false", "no")
+
+# Token buckets per event type: (tokens per second, burst) for each user and
+# for each chat. Override with RATE_LIMITS='{"typing": {"user": [1, 3]}}'
+RATE_LIMITS = {
+    "message": {"user": (5, 20), "chat": (30, 100)},
+    "typing": {"user": (2, 5), "chat": (20, 50)},
+    "reaction": {"user": (5, 15), "chat": (30, 100)},
+    "read_receipt": {"user": (20, 50), "chat": (100, 300)},
+    "delete_message": {"user": (2, 10), "chat": (20, 50)},
+}
+for _event_type, _scopes in json.loads(os.getenv("RATE_LIMITS", "{}")).items():
+    RATE_LIMITS.setdefault(_event_type, {}).update({scope: tuple(limit) for scope, limit in _scopes.items()})
+
+# Tokens taken from Redis per round trip for a steady sender; the local tier
+# spends them without asking Redis again until they run out or LEASE_TTL passes
+LEASE_SIZE = int(os.getenv("RATE_LIMIT_LEASE", "4"))
+LEASE_TTL = 1.0
+
+# Seconds between sweeps of local buckets that have refilled to full
+PRUNE_INTERVAL = 60.0
+
+# While Redis is failing every event fails open; log it at most this often
+FAILURE_LOG_INTERVAL = 10.0
+
+# Takes up to ARGV[1] tokens from every bucket in KEYS at once, or none if
+# any bucket is empty. Returns {granted, index of limiting key, retry_after}
+TOKEN_BUCKET_LUA = """
+local now_parts = redis.call("TIME")
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local granted = tonumber(ARGV[1])
+local levels = {}
+local limited_by = 0
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call("HMGET", key, "tokens", "ts")
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    local available = math.floor(tokens)
+    if available < granted then
+        granted = available
+    end
+    if available < 1 and (1 - tokens) / rate > retry_after then
+        retry_after = (1 - tokens) / rate
+        limited_by = i
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call("HSET", key, "tokens", tostring(levels[i] - granted), "ts", tostring(now))
+    redis.call("EXPIRE", key, math.ceil(burst / rate) + 1)
+end
+return {granted, limited_by, tostring(retry_after)}
+"""
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+class RateLimiter:
+    def __init__(self):
+        # user_id -> {(chat_id, event_type): [tokens, expires_at]} leased from Redis
+        self.leases = {}
+        # user_id -> {event_type: blocked_until} from user-scope Redis denials
+        self.user_blocked = {}
+        # user_id -> {(chat_id, event_type): blocked_until} from chat-scope Redis denials
+        self.blocked = {}
+        # (scope, id, event_type) -> TokenBucket, used when there is no Redis
+        self.buckets = {}
+        self.pruned_at = time.monotonic()
+        self.script = None
+        self.script_client = None
+        self.failure_logged_at = None
+
+    def limits_for(self, chat_id, event_type, charge_user=True):
+        limits = RATE_LIMITS[event_type]
+        scopes = [("user", limits["user"])] if charge_user and "user" in limits else []
+        if chat_id is not None and "chat" in limits:
+            scopes.append(("chat", limits["chat"]))
+        return scopes
+
+    async def check(self, user_id, chat_id, event_type, charge_user=True):
+        """Take one token for the event. Returns None if allowed, otherwise
+        (scope, retry_after) for the bucket that is empty.
+
+        charge_user=False only takes from the chat bucket, for an event whose
+        user token was already taken by an earlier check(user_id, None, ...)."""
+        if not RATE_LIMIT_ENABLED:
+            return None
+        # Unknown types are stored as messages, so they share the message limits
+        if not isinstance(event_type, str) or event_type not in RATE_LIMITS:
+            event_type = "message"
+        if chat_id is not None:
+            chat_id = str(chat_id)
+        scopes = self.limits_for(chat_id, event_type, charge_user)
+        if not scopes:
+            return None
+
+        if redis_manager.redis is None:
+            result = self.check_local(user_id, chat_id, event_type, scopes)
+        else:
+            result = await self.check_redis(user_id, chat_id, event_type, scopes)
+        if result is not None:
+            metrics.record_throttle(event_type, result[0])
+        return result
+
+    def check_local(self, user_id, chat_id, event_type, scopes):
+        now = time.monotonic()
+        self.prune(now)
+
+        # Scopes are checked user first, and new buckets are only stored once
+        # the event is allowed, so a denied user can't create chat buckets
+        buckets = []
+        for scope, (rate, burst) in scopes:
+            key = (scope, user_id if scope == "user" else chat_id, event_type)
+            bucket = self.buckets.get(key) or TokenBucket(rate, burst, now)
+            if bucket.refill(now) < 1:
+                return scope, (1 - bucket.tokens) / bucket.rate
+            buckets.append((key, bucket))
+
+        # Only spend tokens once every bucket has one
+        for key, bucket in buckets:
+            bucket.tokens -= 1
+            self.buckets[key] = bucket
+        return None
+
+    def prune(self, now):
+        # A bucket that has refilled to its burst is the same as no bucket
+        if now - self.pruned_at < PRUNE_INTERVAL:
+            return
+        self.pruned_at = now
+        self.buckets = {k: b for k, b in self.buckets.items() if b.refill(now) < b.burst}
+
+    async def check_redis(self, user_id, chat_id, event_type, scopes):
+        now = time.monotonic()
+        charges_user = scopes[0][0] == "user"
+        # A user-scope denial holds whatever chat the event names, so check it
+        # before any per-chat state; a flood across chat ids stays local
+        user_blocked = self.user_blocked.get(user_id, {}).get(event_type)
+        if charges_user and user_blocked is not None and user_blocked > now:
+            return "user", user_blocked - now
+
+        # Leases hold user and chat tokens together, so chat-only checks
+        # neither spend nor store them
+        key = (chat_id, event_type)
+        lease = self.leases.get(user_id, {}).get(key) if charges_user else None
+        if lease is not None and lease[0] >= 1 and lease[1] > now:
+            lease[0] -= 1
+            return None
+        blocked = self.blocked.get(user_id, {}).get(key)
+        if blocked is not None and blocked > now:
+            return "chat", blocked - now
+
+        # Lease a batch only while the user is sending steadily (previous lease
+        # used up before expiring); one-off events take a single token so many
+        # members don't drain a shared chat bucket with unused leases
+        requested = LEASE_SIZE if lease is not None and lease[1] > now else 1
+        keys = []
+        args = [min(requested, *(burst for _, (_, burst) in scopes))]
+        for scope, (rate, burst) in scopes:
+            keys.append(f"ratelimit:{event_type}:{scope}:{user_id if scope == 'user' else chat_id}")
+            args.extend([rate, burst])
+
+        try:
+            granted, limited_by, retry_after = await self.get_script()(keys=keys, args=args)
+        except Exception as e:
+            # Fail open, a Redis outage shouldn't take chat down with it
+            metrics.ERRORS.labels(where="rate_limit").inc()
+            if self.failure_logged_at is None or now - self.failure_logged_at >= FAILURE_LOG_INTERVAL:
+                self.failure_logged_at = now
+                print(f"Rate limit check failed: {e}")
+            return None
+
+        if int(granted) >= 1:
+            if charges_user:
+                self.leases.setdefault(user_id, {})[key] = [int(granted) - 1, now + LEASE_TTL]
+            self.user_blocked.get(user_id, {}).pop(event_type, None)
+            self.blocked.get(user_id, {}).pop(key, None)
+            return None
+        scope = scopes[int(limited_by) - 1][0]
+        retry_after = float(retry_after)
+        if scope == "user":
+            self.user_blocked.setdefault(user_id, {})[event_type] = now + retry_after
+        else:
+            self.blocked.setdefault(user_id, {})[key] = now + retry_after
+        return scope, retry_after
+
+    def get_script(self):
+        if self.script is None or self.script_client is not redis_manager.redis:
+            self.script_client = redis_manager.redis
+            self.script = self.script_client.register_script(TOKEN_BUCKET_LUA)
+        return self.script
+
+    def forget(self, user_id):
+        # Drop local state for a user whose socket closed
+        self.leases.pop(user_id, None)
+        self.user_blocked.pop(user_id, None)
+        self.blocked.pop(user_id, None)
+
+rate_limiter = RateLimiter()
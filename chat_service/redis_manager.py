@@ -1,10 +1,14 @@
-import redis.asyncio as redis
-import asyncio
 import os
-import json
+import time
+
+import metrics
+from .broker import RedisBroker, MemoryBroker
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 
+# "redis" fans out across workers, "memory" keeps everything in this process
+BROKER = os.getenv("BROKER", "redis")
+
 # Defensive check to ensure the URL has a scheme
 if REDIS_URL and not (REDIS_URL.startswith("redis://") or REDIS_URL.startswith("rediss://") or REDIS_URL.startswith("unix://")):
     # Default to rediss for production endpoints like Upstash
@@ -12,32 +16,37 @@ if REDIS_URL and not (REDIS_URL.startswith("redis://") or REDIS_URL.startswith("
 
 class RedisManager:
     def __init__(self):
-        self.redis = None
-        self.pubsub = None
+        self.broker = None
+
+    @property
+    def redis(self):
+        # Underlying Redis client, None when running on the in-process broker
+        return getattr(self.broker, "redis", None)
 
     async def connect(self):
         try:
-            # Log the connection attempt (safely masking password if present)
-            safe_url = REDIS_URL.split("@")[-1] if "@" in REDIS_URL else REDIS_URL
-            print(f"Connecting to Redis at: {safe_url}")
-            
-            self.redis = await redis.from_url(REDIS_URL, decode_responses=True)
-            self.pubsub = self.redis.pubsub()
-            print("Successfully connected to Redis")
+            if BROKER == "memory":
+                self.broker = MemoryBroker()
+            else:
+                self.broker = RedisBroker(REDIS_URL)
+            await self.broker.connect()
         except Exception as e:
             print(f"Redis Connection Error: {e}")
+            metrics.ERRORS.labels(where="redis_connect").inc()
             raise e
 
     async def publish(self, channel, message):
-        await self.redis.publish(channel, json.dumps(message))
+        started = time.perf_counter()
+        await self.broker.publish(channel, message)
+        metrics.PUBLISH_SECONDS.observe(time.perf_counter() - started)
 
     def get_pubsub(self):
-        return self.redis.pubsub()
+        return self.broker.pubsub()
 
     async def subscribe(self, channel):
-        await self.pubsub.subscribe(channel)
-        async for message in self.pubsub.listen():
-            if message["type"] == "message":
-                yield json.loads(message["data"])
+        pubsub = self.get_pubsub()
+        await pubsub.subscribe(channel)
+        async for message in pubsub.listen():
+            yield message["data"]
 
 redis_manager = RedisManager()
@@ -0,0 +1,159 @@
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from contextlib import contextmanager
+from sqlalchemy import event
+import json
+import os
+import random
+import time
+
+# Sampled tracing is off unless TRACE_SAMPLE_RATE is set (0.0 - 1.0)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+try:
+    from opentelemetry import trace as otel_trace
+    tracer = otel_trace.get_tracer("chatsphere")
+except ImportError:
+    tracer = None
+
+# Sub-millisecond buckets, publish and fan-out are usually well under 5ms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Event types come from the client, anything unknown is folded into "other"
+KNOWN_EVENT_TYPES = {
+    "message", "typing", "read_receipt", "delete_message", "reaction",
+    "offer", "answer", "ice-candidate", "call-request",
+}
+
+ACTIVE_SOCKETS = Gauge("chatsphere_active_sockets", "Open WebSocket connections", ["service"])
+EVENTS = Counter("chatsphere_ws_events_total", "WebSocket events received", ["service", "event_type"])
+THROTTLED = Counter("chatsphere_throttled_total", "WebSocket events rejected by rate limits", ["event_type", "scope"])
+ERRORS = Counter("chatsphere_errors_total", "Exceptions caught in handlers", ["where"])
+PUBLISH_SECONDS = Histogram("chatsphere_publish_seconds", "Broker publish latency", buckets=LATENCY_BUCKETS)
+FANOUT_SECONDS = Histogram(
+    "chatsphere_fanout_seconds", "Latency from publish to send_text on a subscriber socket", buckets=LATENCY_BUCKETS
+)
+DB_QUERIES = Counter("chatsphere_db_queries_total", "SQL statements executed", ["database"])
+DB_QUERY_SECONDS = Histogram(
+    "chatsphere_db_query_seconds", "SQL statement duration", ["database"], buckets=LATENCY_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "chatsphere_http_request_seconds", "HTTP request duration by route", ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def track_sockets(service, connections):
+    # Read the connection dict at scrape time instead of counting on the hot path
+    ACTIVE_SOCKETS.labels(service=service).set_function(lambda: len(connections))
+
+
+def event_label(event_type):
+    if not isinstance(event_type, str) or event_type not in KNOWN_EVENT_TYPES:
+        return "other"
+    return event_type
+
+
+def record_event(service, event_type):
+    EVENTS.labels(service=service, event_type=event_label(event_type)).inc()
+
+
+def record_throttle(event_type, scope):
+    THROTTLED.labels(event_type=event_label(event_type), scope=scope).inc()
+
+
+def instrument_engine(engine, database):
+    queries = DB_QUERIES.labels(database=database)
+    durations = DB_QUERY_SECONDS.labels(database=database)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        durations.observe(time.perf_counter() - conn.info["query_start"].pop())
+        queries.inc()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # after_cursor_execute doesn't run for failed statements, drop the
+        # start time here so pooled connections don't accumulate them
+        if context.connection is not None:
+            starts = context.connection.info.get("query_start")
+            if starts:
+                starts.pop()
+
+
+@contextmanager
+def span(name, **attributes):
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        yield
+        return
+    attributes = {key: value for key, value in attributes.items() if value is not None}
+    if tracer is not None:
+        with tracer.start_as_current_span(name, attributes=attributes):
+            yield
+        return
+    # No OpenTelemetry installed, log sampled spans instead
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        print(json.dumps({"span": name, "duration_ms": round(duration_ms, 3), **attributes}, default=str))
+
+
+def route_label(scope):
+    # Label by route template so ids don't explode label cardinality
+    if "path_params" not in scope:
+        return "unmatched"
+    route = scope.get("route")
+    if route is None:
+        # Mounted apps (StaticFiles) only leave their mount point behind
+        return scope.get("root_path", "") + "/{path}"
+
+    # Depending on the FastAPI version the route's template may not include
+    # the include_router prefix. Render it with the matched values to see how
+    # much of the path it covers; whatever comes before is the prefix.
+    path_format = route.path_format
+    path = scope["path"]
+    try:
+        matched = path_format.format(**scope["path_params"])
+    except (KeyError, IndexError, ValueError):
+        return path_format
+    if path.endswith(matched):
+        return path[:len(path) - len(matched)] + path_format
+    return path_format
+
+
+class HTTPMetricsMiddleware:
+    """Plain ASGI middleware, cheaper than BaseHTTPMiddleware on every request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(
+                method=scope["method"],
+                route=route_label(scope),
+                status=str(status[0]),
+            ).observe(time.perf_counter() - started)
+
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
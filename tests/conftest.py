@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Settings are read at import time, so set them before any service module loads
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ["BROKER"] = "memory"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
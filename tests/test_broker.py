@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import pytest
+
+from chat_service import broker as broker_module
+from chat_service.broker import MemoryBroker, RedisBroker
+from chat_service.redis_manager import RedisManager
+
+
+@pytest.fixture
+def redis_broker():
+    fakeredis = pytest.importorskip("fakeredis")
+    broker = RedisBroker("redis://localhost:6379")
+    broker.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    return broker
+
+
+async def next_message(messages):
+    return await asyncio.wait_for(messages.__anext__(), timeout=1)
+
+
+def test_memory_unsubscribe_without_channels_removes_every_channel():
+    async def run():
+        broker = MemoryBroker()
+        first, second = broker.pubsub(), broker.pubsub()
+        await first.subscribe("chat_a", "chat_b", "user_1")
+        await second.subscribe("chat_a")
+
+        await first.unsubscribe()
+        assert first.channels == set()
+        assert dict(broker.subscribers) == {"chat_a": {second}}
+
+        await second.unsubscribe()
+        assert dict(broker.subscribers) == {}
+    asyncio.run(run())
+
+
+def test_memory_slow_subscriber_is_disconnected(monkeypatch):
+    monkeypatch.setattr(broker_module, "MEMORY_QUEUE_SIZE", 3)
+
+    async def run():
+        broker = MemoryBroker()
+        slow, fast = broker.pubsub(), broker.pubsub()
+        await slow.subscribe("chat_a", "user_1")
+        await fast.subscribe("chat_a")
+        fast_messages = fast.listen()
+
+        for i in range(3):
+            await broker.publish("chat_a", {"n": i})
+            assert (await next_message(fast_messages))["data"] == {"n": i}
+        assert slow.queue.qsize() == 3
+
+        # The fourth message overflows the slow subscriber's queue
+        await broker.publish("chat_a", {"n": 3})
+        assert (await next_message(fast_messages))["data"] == {"n": 3}
+        assert slow.closed
+        assert dict(broker.subscribers) == {"chat_a": {fast}}
+        with pytest.raises(ConnectionError):
+            await next_message(slow.listen())
+
+        # Closed subscriptions don't come back by subscribing to a new chat
+        await slow.subscribe("chat_b")
+        assert "chat_b" not in broker.subscribers
+    asyncio.run(run())
+
+
+def test_redis_listen_strips_publish_time(redis_broker):
+    async def run():
+        subscription = redis_broker.pubsub()
+        await subscription.subscribe("chat_a")
+        messages = subscription.listen()
+        pending = asyncio.ensure_future(next_message(messages))
+        await asyncio.sleep(0.05)
+
+        await redis_broker.publish("chat_a", {"type": "message", "content": "hi"})
+        message = await pending
+        await subscription.unsubscribe()
+        return message
+
+    message = asyncio.run(run())
+    assert message["channel"] == "chat_a"
+    assert message["data"] == {"type": "message", "content": "hi"}
+    assert json.loads(message["text"]) == message["data"]
+    assert "_published_at" not in message["text"]
+    assert isinstance(message["published_at"], float)
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_manager_subscribe_yields_published_dict(backend, request):
+    manager = RedisManager()
+    manager.broker = MemoryBroker() if backend == "memory" else request.getfixturevalue("redis_broker")
+
+    async def run():
+        messages = manager.subscribe("user_1")
+        pending = asyncio.ensure_future(next_message(messages))
+        await asyncio.sleep(0.05)
+        await manager.publish("user_1", {"type": "new_chat", "chat_id": "abc"})
+        return await pending
+
+    assert asyncio.run(run()) == {"type": "new_chat", "chat_id": "abc"}
@@ -0,0 +1,54 @@
+import json
+import uuid
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+from app import app
+
+
+def test_events_for_foreign_chats_are_rejected():
+    owner, other, outsider = (str(uuid.uuid4()) for _ in range(3))
+    with TestClient(app) as client:
+        chat_id = client.post("/chat/chats/create", json={"members": [owner, other]}).json()["id"]
+
+        with client.websocket_connect(f"/chat/ws/{outsider}") as ws:
+            for bad_id in (chat_id, str(uuid.uuid4()), "not-a-chat"):
+                ws.send_text(json.dumps({"type": "message", "chat_id": bad_id, "content": "hi"}))
+                frame = json.loads(ws.receive_text())
+                assert frame["type"] == "error"
+                assert frame["code"] == "not_a_member"
+
+        history = client.get(f"/chat/history/{chat_id}", params={"user_id": owner}).json()
+        assert history == []
+
+
+def test_chat_created_after_connecting_is_joined():
+    user, other = str(uuid.uuid4()), str(uuid.uuid4())
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/chat/ws/{user}") as ws:
+            chat_id = client.post("/chat/chats/create", json={"members": [user, other]}).json()["id"]
+
+            ws.send_text(json.dumps({"type": "message", "chat_id": chat_id, "content": "hello"}))
+            frame = json.loads(ws.receive_text())
+            assert frame["type"] == "message"
+            assert frame["content"] == "hello"
+
+
+def test_chat_joined_after_connecting_gets_full_user_burst(monkeypatch):
+    from chat_service import rate_limiter as module
+
+    # Freeze the limiter's clock so no tokens refill mid-test
+    monkeypatch.setattr(module, "time", SimpleNamespace(monotonic=lambda: 1000.0))
+    burst = module.RATE_LIMITS["message"]["user"][1]
+    user, other = str(uuid.uuid4()), str(uuid.uuid4())
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/chat/ws/{user}") as ws:
+            chat_id = client.post("/chat/chats/create", json={"members": [user, other]}).json()["id"]
+
+            for i in range(burst + 5):
+                ws.send_text(json.dumps({"type": "message", "chat_id": chat_id, "content": str(i)}))
+            frames = [json.loads(ws.receive_text()) for _ in range(burst + 5)]
+
+    assert sum(frame["type"] == "message" for frame in frames) == burst
+    assert [frame.get("code") for frame in frames if frame["type"] == "error"] == ["rate_limited"] * 5
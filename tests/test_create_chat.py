@@ -0,0 +1,95 @@
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, select, text
+
+from app import app
+from chat_service import models
+from chat_service.models import Base, Chat, ChatMember
+
+
+def test_dm_is_found_with_either_member_order():
+    a, b = str(uuid.uuid4()), str(uuid.uuid4())
+    with TestClient(app) as client:
+        created = client.post("/chat/chats/create", json={"members": [a, b]}).json()
+        again = client.post("/chat/chats/create", json={"members": [b, a]}).json()
+        same = client.post("/chat/chats/create", json={"members": [a, b]}).json()
+
+    assert created["status"] == "created"
+    assert again == same == {"id": created["id"], "status": "existing"}
+
+
+def test_duplicate_members_are_added_once():
+    a, b = str(uuid.uuid4()), str(uuid.uuid4())
+    with TestClient(app) as client:
+        chat_id = client.post("/chat/chats/create", json={"members": [a, b, a]}).json()["id"]
+        assert client.post("/chat/chats/create", json={"members": [b, a, b]}).json()["id"] == chat_id
+
+    with models.SessionLocal() as db:
+        members = db.execute(select(ChatMember.user_id).where(ChatMember.chat_id == uuid.UUID(chat_id))).scalars()
+        assert sorted(map(str, members)) == sorted([a, b])
+
+
+def test_group_members_are_inserted_in_one_statement():
+    members = [str(uuid.uuid4()) for _ in range(5)]
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("INSERT INTO CHAT_MEMBERS"):
+            statements.append(executemany)
+
+    with TestClient(app) as client:
+        event.listen(models.engine, "before_cursor_execute", count)
+        try:
+            response = client.post("/chat/chats/create", json={"members": members, "is_group": True, "name": "g"})
+        finally:
+            event.remove(models.engine, "before_cursor_execute", count)
+        history = client.get(f"/chat/history/{response.json()['id']}", params={"user_id": members[-1]})
+
+    assert statements == [False]
+    assert history.status_code == 200
+
+
+def old_schema_engine():
+    # A chats table from before dm_key existed
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'old.db')}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_chats_dm_key"))
+        conn.execute(text("ALTER TABLE chats DROP COLUMN dm_key"))
+    return engine
+
+
+def test_ensure_dm_keys_backfills_oldest_duplicate(monkeypatch):
+    engine = old_schema_engine()
+    monkeypatch.setattr(models, "engine", engine)
+    a, b, c = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    started = datetime(2024, 1, 1)
+    chats = [(uuid.uuid4(), offset, users) for offset, users in ((2, (b, a)), (0, (a, b)), (1, (a, b)), (3, (a, c)))]
+    with engine.begin() as conn:
+        for chat_id, offset, users in chats:
+            conn.execute(Chat.__table__.insert().values(
+                id=chat_id, is_group=False, created_at=started + timedelta(days=offset)
+            ))
+            conn.execute(ChatMember.__table__.insert(), [{"chat_id": chat_id, "user_id": u} for u in users])
+
+    models.ensure_dm_keys()
+
+    with engine.connect() as conn:
+        keys = dict(conn.execute(select(Chat.id, Chat.dm_key)).all())
+    oldest_ab, newer_ba, newer_ab, ac = (chats[1][0], chats[0][0], chats[2][0], chats[3][0])
+    assert keys[oldest_ab] == models.make_dm_key(a, b)
+    assert keys[newer_ba] is None
+    assert keys[newer_ab] is None
+    assert keys[ac] == models.make_dm_key(a, c)
+
+    # Already migrated, a second start doesn't touch the table
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+    models.ensure_dm_keys()
+    assert not [s for s in statements if not s.lstrip().upper().startswith(("PRAGMA", "SELECT"))]
+    with engine.connect() as conn:
+        assert dict(conn.execute(select(Chat.id, Chat.dm_key)).all()) == keys
@@ -0,0 +1,67 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, exc, text
+
+import metrics
+from app import app
+
+
+def test_failed_statements_do_not_leak_start_times():
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine, "test")
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+        conn.execute(text("SELECT 1"))
+        assert conn.info["query_start"] == []
+
+
+@pytest.mark.parametrize(
+    "path, path_format, params, expected",
+    [
+        ("/chat/history/abc", "/history/{chat_id}", {"chat_id": "abc"}, "/chat/history/{chat_id}"),
+        ("/chat/history/history", "/history/{chat_id}", {"chat_id": "history"}, "/chat/history/{chat_id}"),
+        ("/chat/history/history", "/chat/history/{chat_id}", {"chat_id": "history"}, "/chat/history/{chat_id}"),
+        ("/a/1/b/2", "/a/{x}/b/{y}", {"x": "1", "y": "2"}, "/a/{x}/b/{y}"),
+        ("/auth/me", "/me", {}, "/auth/me"),
+    ],
+)
+def test_route_label_uses_route_template(path, path_format, params, expected):
+    scope = {"path": path, "path_params": params, "route": SimpleNamespace(path_format=path_format)}
+    assert metrics.route_label(scope) == expected
+
+
+def test_route_label_for_mounts_and_unmatched_paths():
+    assert metrics.route_label({"path": "/uploads/a/b.png", "root_path": "/uploads", "path_params": {}}) == "/uploads/{path}"
+    assert metrics.route_label({"path": "/nowhere/123"}) == "unmatched"
+
+
+def requests_for(route):
+    # Request count for a route label across every method and status
+    return sum(
+        sample.value
+        for family in REGISTRY.collect()
+        if family.name == "chatsphere_http_request_seconds"
+        for sample in family.samples
+        if sample.name.endswith("_count") and sample.labels["route"] == route
+    )
+
+
+def test_http_requests_are_labelled_by_route():
+    requests = {
+        "/chat/history/history": "/chat/history/{chat_id}",
+        "/uploads/missing.txt": "/uploads/{path}",
+        "/nowhere/123": "unmatched",
+    }
+    before = {route: requests_for(route) for route in requests.values()}
+    with TestClient(app, raise_server_exceptions=False) as client:
+        for path in requests:
+            client.get(path, params={"user_id": str(uuid.uuid4())})
+    for path, route in requests.items():
+        assert requests_for(route) == before[route] + 1
+        assert requests_for(path) == 0
@@ -0,0 +1,130 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from chat_service.broker import RedisBroker
+from chat_service.rate_limiter import RATE_LIMITS, RateLimiter
+from chat_service.redis_manager import redis_manager
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    broker = RedisBroker("redis://localhost:6379")
+    broker.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(redis_manager, "broker", broker)
+    return broker.redis
+
+
+def count_script_calls(limiter):
+    calls = []
+    get_script = limiter.get_script
+
+    def counting():
+        calls.append(1)
+        return get_script()
+
+    limiter.get_script = counting
+    return calls
+
+
+def flood(limiter, user_id, chat_ids, event_type="message"):
+    async def run():
+        return [await limiter.check(user_id, chat_id, event_type) for chat_id in chat_ids]
+    return asyncio.run(run())
+
+
+def test_redis_flood_across_chat_ids_stays_local(fake_redis):
+    limiter = RateLimiter()
+    calls = count_script_calls(limiter)
+    burst = RATE_LIMITS["message"]["user"][1]
+
+    results = flood(limiter, "flooder", [str(uuid.uuid4()) for _ in range(1000)])
+
+    assert sum(r is None for r in results) == burst
+    assert {r[0] for r in results if r is not None} == {"user"}
+    # One script call per allowed event plus the denial, then the cached
+    # user-scope denial answers everything else whatever the chat id
+    assert len(calls) == burst + 1
+    assert not limiter.blocked.get("flooder")
+    assert len(asyncio.run(fake_redis.keys("ratelimit:*"))) == burst + 2
+
+
+def test_redis_chat_bucket_shared_by_members(fake_redis):
+    limiter = RateLimiter()
+    burst = RATE_LIMITS["delete_message"]["chat"][1]
+
+    async def run():
+        return [await limiter.check(f"user-{i}", "chat", "delete_message") for i in range(burst + 10)]
+    results = asyncio.run(run())
+
+    assert sum(r is None for r in results) == burst
+    assert {r[0] for r in results if r is not None} == {"chat"}
+
+
+def test_local_flood_across_chat_ids():
+    limiter = RateLimiter()
+    burst = RATE_LIMITS["message"]["user"][1]
+
+    results = flood(limiter, "flooder", [str(uuid.uuid4()) for _ in range(1000)])
+
+    assert sum(r is None for r in results) == burst
+    assert {r[0] for r in results if r is not None} == {"user"}
+    # The user bucket plus one chat bucket per allowed event, none for denials
+    assert len(limiter.buckets) == burst + 1
+
+
+def test_local_buckets_are_pruned_once_full(monkeypatch):
+    from chat_service import rate_limiter as module
+
+    now = [1000.0]
+    monkeypatch.setattr(module, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    limiter = RateLimiter()
+    flood(limiter, "user", [str(uuid.uuid4()) for _ in range(10)])
+    assert len(limiter.buckets) == 11
+
+    now[0] += module.PRUNE_INTERVAL + 1
+    flood(limiter, "user", ["chat"])
+    assert set(limiter.buckets) == {("user", "user", "message"), ("chat", "chat", "message")}
+
+
+@pytest.mark.parametrize("backend", ["local", "redis"])
+def test_chat_only_check_leaves_user_bucket(backend, request):
+    if backend == "redis":
+        request.getfixturevalue("fake_redis")
+    limiter = RateLimiter()
+    burst = RATE_LIMITS["message"]["user"][1]
+
+    async def run():
+        allowed = 0
+        for _ in range(burst + 5):
+            if await limiter.check("user", None, "message") is None:
+                allowed += 1
+                assert await limiter.check("user", "chat", "message", charge_user=False) is None
+        return allowed
+    assert asyncio.run(run()) == burst
+
+
+def test_redis_failures_are_logged_at_intervals(monkeypatch, capsys):
+    from chat_service import rate_limiter as module
+
+    now = [1000.0]
+    monkeypatch.setattr(module, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    broker = RedisBroker("redis://localhost:6379")
+    broker.redis = SimpleNamespace(register_script=lambda script: None)
+    monkeypatch.setattr(redis_manager, "broker", broker)
+    limiter = RateLimiter()
+
+    def failing_script(keys, args):
+        raise ConnectionError("redis down")
+    limiter.get_script = lambda: failing_script
+
+    results = flood(limiter, "user", ["chat"] * 50)
+    now[0] += module.FAILURE_LOG_INTERVAL
+    results += flood(limiter, "user", ["chat"] * 50)
+
+    assert results == [None] * 100
+    assert capsys.readouterr().out.count("Rate limit check failed") == 2